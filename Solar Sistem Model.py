@@ -1,5 +1,14 @@
 from ursina import *
 import math
+from dataclasses import dataclass, field
+import numpy as np
+from panda3d.core import NodePath
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:  # Numba необязательна: без нее работает векторный путь NumPy
+    HAS_NUMBA = False
 
 app = Ursina()
 
@@ -16,80 +25,307 @@ CENTER_X = 0
 CENTER_Z = 0
 show_orbits = True
 
+# Единичная окружность для линий орбит (считается один раз)
+_ANG = np.radians(np.arange(361))
+_COS = np.cos(_ANG)
+_SIN = np.sin(_ANG)
+
+# Общий меш единичной орбиты: все орбиты круговые, поэтому каждая линия
+# получает инстанс этого узла (одна геометрия и один вершинный буфер на все
+# линии) и масштабируется до своего радиуса. Сам шаблон в сцену не добавляется
+_UNIT_CIRCLE_MESH = Mesh(
+    vertices=list(zip(_COS.tolist(), [0.0] * len(_COS), _SIN.tolist())),
+    mode='line',
+    thickness=2
+)
+
+
+def _unit_circle_instance():
+    # copy(Mesh) заново строит геометрию, а instance_to делит ее с шаблоном
+    node = NodePath('orbit_line')
+    _UNIT_CIRCLE_MESH.instance_to(node)
+    return node
+
+
+# Полупрозрачные цвета линий орбит, по одному на базовый цвет
+_faded = {}
+
+
+def _fade(c, a=80):
+    k = (c.r, c.g, c.b, a)
+    v = _faded.get(k)
+    return v or _faded.setdefault(k, color.rgba(*k))
+
+
+# Хвост кометы: переиспользуемый пул частиц вместо создания/удаления каждый кадр
+TRAIL_POOL_SIZE = 64
+TRAIL_LIFETIME = 0.1  # секунды
+TRAIL_ALPHA = 100 / 255
+TRAIL_COLOR = color.rgba(200, 200, 255, 100)
+
+
+def _empty():
+    return np.zeros(0)
+
+
+def _step_kernel(angles, speeds, orbit_radii, tilts_cos, tilts_sin, parent_idx,
+                 current_scale, global_speed, out):
+    # Один проход по телам в нативном коде. Родитель всегда создается раньше
+    # спутника, поэтому его позиция в out уже посчитана
+    for i in range(angles.shape[0]):
+        angles[i] += speeds[i] * global_speed
+        r = orbit_radii[i] * current_scale
+        lx = r * math.cos(angles[i])
+        lz = r * math.sin(angles[i])
+
+        x = lx
+        y = -lz * tilts_sin[i]
+        z = lz * tilts_cos[i]
+        p = parent_idx[i]
+        if p >= 0:
+            x += out[p, 0]
+            y += out[p, 1]
+            z += out[p, 2]
+        out[i, 0] = x
+        out[i, 1] = y
+        out[i, 2] = z
+
+
+if HAS_NUMBA:
+    _step_kernel = njit(cache=True, fastmath=True)(_step_kernel)
+    # Прогреваем ядро при загрузке, чтобы компиляция не пришлась на первый кадр
+    _step_kernel(np.zeros(1), np.zeros(1), np.zeros(1), np.ones(1), np.zeros(1),
+                 np.full(1, -1), 1.0, 1.0, np.empty((1, 3)))
+
+
+@dataclass
+class SystemState:
+    # Состояние всех тел в виде параллельных массивов (struct-of-arrays),
+    # чтобы считать позиции за один векторный шаг, а не в цикле по планетам
+    angles: np.ndarray = field(default_factory=_empty)
+    speeds: np.ndarray = field(default_factory=_empty)
+    orbit_radii: np.ndarray = field(default_factory=_empty)
+    tilts_cos: np.ndarray = field(default_factory=_empty)
+    tilts_sin: np.ndarray = field(default_factory=_empty)
+    parent_idx: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=int))
+    bound_radii: np.ndarray = field(default_factory=_empty)
+    depths: np.ndarray = field(default_factory=lambda: np.zeros(0, dtype=int))
+    # Центры ограничивающих сфер на момент последней записи в сцену
+    last_centers: np.ndarray = field(default_factory=lambda: np.zeros((0, 3)))
+
+    def add(self, speed_rad, orbit_radius, angle_offset_rad, tilt, parent_idx=-1, body_radius=0.0):
+        # Регистрируем тело и возвращаем его индекс в массивах.
+        # Углы и скорости хранятся в радианах, чтобы не переводить их каждый кадр.
+        # Начальный сдвиг угла входит в сам угол, так что каждый кадр
+        # считаются только cos и sin одного и того же аргумента
+        tilt_rad = math.radians(tilt)
+        # Ограничивающая сфера для отсечения: у спутника она описана вокруг
+        # родителя и включает всю его орбиту с линией
+        bound_radius = body_radius + orbit_radius if parent_idx >= 0 else body_radius
+        # Родитель регистрируется раньше спутника, поэтому порядок индексов
+        # уже топологический: позиция родителя готова к моменту расчета спутника
+        depth = self.depths[parent_idx] + 1 if parent_idx >= 0 else 0
+        self.angles = np.append(self.angles, angle_offset_rad)
+        self.speeds = np.append(self.speeds, speed_rad)
+        self.orbit_radii = np.append(self.orbit_radii, orbit_radius)
+        self.tilts_cos = np.append(self.tilts_cos, math.cos(tilt_rad))
+        self.tilts_sin = np.append(self.tilts_sin, math.sin(tilt_rad))
+        self.parent_idx = np.append(self.parent_idx, parent_idx)
+        self.bound_radii = np.append(self.bound_radii, bound_radius)
+        self.depths = np.append(self.depths, depth)
+        # Сущности создаются в начале координат
+        self.last_centers = np.vstack((self.last_centers, (0.0, 0.0, 0.0)))
+        return len(self.angles) - 1
+
+    def step(self, current_scale, global_speed):
+        # Двигаем все тела сразу и возвращаем мировые позиции (N, 3)
+        if HAS_NUMBA:
+            pos = np.empty((len(self.angles), 3))
+            _step_kernel(self.angles, self.speeds, self.orbit_radii,
+                         self.tilts_cos, self.tilts_sin, self.parent_idx,
+                         float(current_scale), float(global_speed), pos)
+            return pos
+
+        self.angles += self.speeds * global_speed
+        radii = self.orbit_radii * current_scale
+
+        lx = radii * np.cos(self.angles)
+        lz = radii * np.sin(self.angles)
+
+        # Наклон плоскости орбиты (поворот вокруг оси X)
+        pos = np.empty((len(self.angles), 3))
+        pos[:, 0] = lx
+        pos[:, 1] = -lz * self.tilts_sin
+        pos[:, 2] = lz * self.tilts_cos
+
+        # Спутники вращаются вокруг родителя: добавляем его уже посчитанную
+        # позицию уровень за уровнем, как это делает ядро Numba по порядку индексов
+        for d in range(1, int(self.depths.max(initial=0)) + 1):
+            level = self.depths == d
+            pos[level] += pos[self.parent_idx[level]]
+        return pos
+
+    def bounds(self, positions, current_scale):
+        # Центры и радиусы ограничивающих сфер для позиций из step
+        centers = positions.copy()
+        children = self.parent_idx >= 0
+        centers[children] = positions[self.parent_idx[children]]
+        return centers, self.bound_radii * current_scale
+
+    def update_visibility(self, positions, current_scale):
+        # Тело обновляется, если в кадре его новое положение или то, где оно
+        # нарисовано сейчас. Иначе ушедшее из кадра тело замирает на краю,
+        # а при повороте камеры назад видно его устаревшее положение.
+        # Для обновленных тел запоминает новые центры в last_centers.
+        # Обе позиции проверяются за один вызов in_view
+        centers, radii = self.bounds(positions, current_scale)
+        n = len(centers)
+        hit = in_view(np.vstack((centers, self.last_centers)), np.concatenate((radii, radii)))
+        vis = hit[:n] | hit[n:]
+        self.last_centers[vis] = centers[vis]
+        return vis
+
+
+def in_view(centers, radii):
+    # Грубое отсечение: сфера против конуса, описанного вокруг пирамиды камеры
+    cam = np.array(camera.world_position, dtype=float)
+    rel = centers - cam
+
+    if camera.orthographic:
+        # В ортографической камере (Shift+P в EditorCamera) fov - это высота
+        # кадра в мировых единицах, а не угол: проверяем сферу против прямоугольника
+        right = np.array(camera.right, dtype=float)
+        up = np.array(camera.up, dtype=float)
+        half_w = camera.fov * camera.aspect_ratio / 2
+        half_h = camera.fov / 2
+        return (np.abs(rel @ right) < half_w + radii) & (np.abs(rel @ up) < half_h + radii)
+
+    fwd = np.array(camera.forward, dtype=float)
+    fwd /= np.linalg.norm(fwd)
+
+    tan_half = math.tan(math.radians(camera.fov) / 2) * math.sqrt(1 + 1 / camera.aspect_ratio ** 2)
+    half = math.atan(tan_half)
+
+    along = rel @ fwd
+    perp = np.sqrt(np.maximum((rel * rel).sum(axis=1) - along * along, 0.0))
+    # Расстояние от центра до боковой поверхности конуса
+    cone_dist = perp * math.cos(half) - along * math.sin(half)
+    return (along > -radii) & (cone_dist < radii)
+
+
+system = SystemState()
+
 
 class Planet:
-    def __init__(self, body_color, radius, orbit_radius, speed, Main_planet=None, angle=0, is_ring=False, tilt=0):
+    # Без __dict__: экземпляры меньше, а чтение атрибутов в update_logic быстрее.
+    # Поля пула хвоста заполняются только у кометы
+    __slots__ = ('color', 'radius2', 'orbit_radius2', 'speed', 'Main_planet', 'angle2', 'is_ring', 'tilt',
+                 'speed_rad', 'angle2_rad', 'index', 'entity', 'orbit_line', 'is_comet', 'trail_timer',
+                 '_trail_pool', '_trail_scale', '_trail_start', '_trail_alive', '_trail_idx')
+
+    def __init__(self, body_color, radius, orbit_radius, speed, Main_planet=None, angle=0, is_ring=False, tilt=0,
+                 is_comet=False):
         self.color = body_color
         self.radius2 = radius / 5
         self.orbit_radius2 = orbit_radius / 10
         self.speed = speed
-        self.angle = 0
         self.Main_planet = Main_planet
         self.angle2 = angle
         self.is_ring = is_ring
         self.tilt = tilt  # Наклон плоскости орбиты в градусах
+        self.speed_rad = math.radians(speed)
+        self.angle2_rad = math.radians(angle)
 
-        # Контейнер для наклона (Pivot)
-        self.orbit_pivot = Entity(rotation_x=self.tilt)
+        # Угол и позиция считаются в общем состоянии системы
+        self.index = system.add(self.speed_rad, self.orbit_radius2, self.angle2_rad, tilt,
+                                Main_planet.index if Main_planet else -1,
+                                self.radius2 / 2 if not is_ring else 0.0)
 
+        # Позиция тела уже включает наклон, поэтому оно живет в мировых координатах
         self.entity = Entity(
-            parent=self.orbit_pivot,
             model='sphere',
             color=self.color,
             scale=self.radius2 if not is_ring else 0
         )
 
         self.create_orbit_line()
-        self.is_comet = False
+        self.is_comet = is_comet
         self.trail_timer = 0
 
+        if self.is_comet:
+            self._trail_pool = [Entity(model='sphere', color=TRAIL_COLOR, enabled=False)
+                                for _ in range(TRAIL_POOL_SIZE)]
+            self._trail_scale = np.zeros(TRAIL_POOL_SIZE)
+            self._trail_start = np.ones(TRAIL_POOL_SIZE)
+            self._trail_alive = np.zeros(TRAIL_POOL_SIZE, dtype=bool)
+            self._trail_idx = 0
+
     def create_orbit_line(self):
-        # Линия орбиты создается внутри pivot, чтобы она тоже наклонялась
+        # Линия орбиты сама наклонена на угол орбиты, отдельный pivot не нужен
         self.orbit_line = Entity(
-            parent=self.orbit_pivot,
-            model=Mesh(
-                vertices=[
-                    (math.cos(math.radians(i)) * self.orbit_radius2, 0, math.sin(math.radians(i)) * self.orbit_radius2)
-                    for i in range(361)],
-                mode='line',
-                thickness=2
-            ),
-            color=color.rgba(self.color.r, self.color.g, self.color.b, 80),
+            rotation_x=self.tilt,
+            model=_unit_circle_instance(),
+            scale=self.orbit_radius2,
+            color=_fade(self.color),
             enabled=show_orbits
         )
 
-    def update_logic(self, current_scale, global_speed):
-        self.angle += self.speed * global_speed
-        self.orbit_radius = self.orbit_radius2 * current_scale
+    def update_logic(self, current_scale, positions, dt, visible=True):
+        # Записываем в сцену позицию, посчитанную в SystemState.step.
+        # Тело пропускается, только если вне кадра и его новое, и текущее
+        # положение в сцене (см. SystemState.update_visibility)
+        if not visible:
+            if self.is_comet:
+                self.fade_trail(dt)
+            return
 
         if not self.is_ring:
             self.entity.scale = self.radius2 * current_scale
 
         # Базовая позиция центра вращения
-        base_pos = self.Main_planet.entity.world_position if self.Main_planet else Vec3(0, 0, 0)
-        self.orbit_pivot.position = base_pos
-        self.orbit_line.scale = current_scale
-
-
-        lx = self.orbit_radius * math.cos(math.radians(self.angle + self.angle2))
-        lz = self.orbit_radius * math.sin(math.radians(self.angle))
+        base_pos = positions[self.Main_planet.index] if self.Main_planet else (0, 0, 0)
+        self.orbit_line.position = tuple(base_pos)
+        self.orbit_line.scale = self.orbit_radius2 * current_scale
 
-        self.entity.position = (lx, 0, lz)
-        self.orbit_line.enabled = show_orbits
+        x, y, z = positions[self.index]
+        self.entity.position = (x, y, z)
 
         if self.is_comet:
-            self.draw_trail()
+            self.draw_trail(dt)
 
-    def draw_trail(self):
-        self.trail_timer += time.dt
+    def draw_trail(self, dt):
+        self.fade_trail(dt)
+
+        self.trail_timer += dt
         if self.trail_timer > 0.000005:
-            # Частицы создаются в мировых координатах
-            t = Entity(model='sphere', position=self.entity.world_position,
-                       scale=self.entity.scale * 0.7, color=color.rgba(200, 200, 255, 100))
-            t.animate_scale(0.5, duration=0.05)
-            destroy(t, delay=0.1)
+            # Берем следующую частицу из пула (самая старая перезаписывается)
+            i = self._trail_idx
+            t = self._trail_pool[i]
+            t.position = self.entity.position
+            t.scale = self.entity.scale_x * 0.7
+            t.alpha = TRAIL_ALPHA
+            t.enabled = True
+            self._trail_scale[i] = self._trail_start[i] = self.entity.scale_x * 0.7
+            self._trail_alive[i] = True
+            self._trail_idx = (i + 1) % TRAIL_POOL_SIZE
             self.trail_timer = 0
 
+    def fade_trail(self, dt):
+        # Частицы линейно уменьшаются и гаснут за TRAIL_LIFETIME, затем выключаются.
+        # Считаем сразу по всему пулу вместо animate_scale на каждую частицу
+        alive = self._trail_alive
+        self._trail_scale[alive] -= self._trail_start[alive] * (dt / TRAIL_LIFETIME)
+        dead = alive & (self._trail_scale <= 0)
+        for i in np.flatnonzero(dead):
+            self._trail_pool[i].enabled = False
+        alive &= ~dead
+
+        for i in np.flatnonzero(alive):
+            t = self._trail_pool[i]
+            k = self._trail_scale[i] / self._trail_start[i]
+            t.scale = self._trail_scale[i]
+            t.alpha = TRAIL_ALPHA * k
+
 
 # Солнце
 sun = Entity(model='sphere', color=color.yellow, scale=5, emissive_color=color.yellow)
@@ -110,8 +346,7 @@ uranus_ring = Planet(color.gray, 8, 0.1, 0, Main_planet=uranus, is_ring=True)
 neptune = Planet(color.rgb(65, 105, 225), 3.57, 750, 0.1, tilt=1.8)
 
 # Комета
-haley = Planet(color.rgb(1, 1, 1), 1, 800, 0.07, angle=50, tilt=18)
-haley.is_comet = True
+haley = Planet(color.rgb(1, 1, 1), 1, 800, 0.07, angle=50, tilt=18, is_comet=True)
 
 # Спутники
 moon = Planet(color.light_gray, 1, 15, 3.0, Main_planet=earth)
@@ -123,19 +358,25 @@ planets = [mercury, venus, earth, mars, jupiter, saturn_body, saturn_ring,
 
 
 def input(key):
-    global show_orbits
+    global show_orbits, speed
+    # Скорость меняется по нажатию, а не каждый кадр, пока клавиша зажата
+    if key == 'right arrow': speed += 0.1
+    if key == 'left arrow':  speed -= 0.1
+    if key == 'space':       speed = 1
+
     if key == 'f':
         show_orbits = not show_orbits
+        for p in planets:
+            p.orbit_line.enabled = show_orbits
 
 
 def update():
-    global scale, speed
-    if held_keys['right arrow']: speed += 0.1
-    if held_keys['left arrow']:  speed -= 0.1
-    if held_keys['space']:       speed = 1
-
+    dt = time.dt
+    pos = system.step(scale, speed)
+    visible = system.update_visibility(pos, scale).tolist()
+    positions = pos.tolist()
     for p in planets:
-        p.update_logic(scale, speed)
+        p.update_logic(scale, positions, dt, visible[p.index])
 
 
 app.run()
\ No newline at end of file
@@ -3,9 +3,13 @@ from __future__ import annotations
 from math import cos, sin, pi
 from pathlib import Path
 
+import numpy as np
+
+from PIL import Image, ImageDraw, ImageFont
+from panda3d.core import OmniBoundingVolume
 from ursina import (
-    Ursina, Entity, Vec3, color, time, Text,
-    AmbientLight, PointLight, Mesh,
+    Ursina, Entity, color, time, Text,
+    AmbientLight, PointLight, Mesh, Shader, Texture,
     window, application
 )
 from ursina.prefabs.editor_camera import EditorCamera
@@ -25,18 +29,33 @@ def clamp(x: float, a: float, b: float) -> float:
     return max(a, min(b, x))
 
 
-def orbit_ring(radius: float, segments: int = 180, line_color=color.rgba(255, 255, 255, 70)) -> Entity:
+ORBIT_SEGMENTS = 180
+
+# Единичная окружность для орбит планет считается один раз при загрузке
+_ORBIT_T = np.linspace(0, 2 * pi, ORBIT_SEGMENTS + 1)
+_ORBIT_COS = np.cos(_ORBIT_T)
+_ORBIT_SIN = np.sin(_ORBIT_T)
+
+
+def orbit_ring(radius: float, segments: int = ORBIT_SEGMENTS, line_color=color.rgba(255, 255, 255, 70)) -> Entity:
     # Рисуем орбиту линией (без заливки)
-    verts = []
-    for i in range(segments + 1):
-        t = (i / segments) * 2 * pi
-        verts.append(Vec3(cos(t) * radius, 0, sin(t) * radius))
+    if segments == ORBIT_SEGMENTS:
+        unit_cos, unit_sin = _ORBIT_COS, _ORBIT_SIN
+    else:
+        t = np.linspace(0, 2 * pi, segments + 1)
+        unit_cos, unit_sin = np.cos(t), np.sin(t)
+    xs = unit_cos * radius
+    zs = unit_sin * radius
+    verts = list(zip(xs.tolist(), [0.0] * (segments + 1), zs.tolist()))
 
     mesh = Mesh(vertices=verts, mode="line", thickness=1)
     return Entity(model=mesh, color=line_color)
 
 
 class Planet:
+    # Без __dict__: экземпляры меньше, а чтение атрибутов в update быстрее
+    __slots__ = ("name", "r", "period", "size", "spin_speed", "theta", "_w", "pivot", "body", "orbit")
+
     def __init__(
         self,
         name: str,
@@ -55,6 +74,7 @@ class Planet:
         self.size = size
         self.spin_speed = spin_speed
         self.theta = 0.0
+        self._w = (2 * pi) / self.period  # угловая скорость, рад/с
 
         # Пивот нужен для наклона плоскости орбиты
         self.pivot = Entity(rotation=(orbit_tilt_deg, 0, 0))
@@ -69,34 +89,26 @@ class Planet:
             position=(orbit_radius, 0, 0),
         )
 
-        # Подпись рядом с планетой
-        self.label = Text(
-            text=name,
-            parent=self.body,
-            position=(0.9, 0.9),
-            scale=1.1,
-            color=color.white,
-            billboard=True,
-        )
-
         # Линия орбиты для наглядности
         self.orbit = orbit_ring(orbit_radius)
         self.orbit.parent = self.pivot
         self.orbit.enabled = show_orbit
 
-    def update(self, time_scale: float):
+    def update(self, dt: float, time_scale: float):
         # Обновляем положение по окружности и вращение вокруг оси
-        w = (2 * pi) / self.period
-        self.theta += w * time.dt * time_scale
-
-        x = self.r * cos(self.theta)
-        z = self.r * sin(self.theta)
-        self.body.position = Vec3(x, 0, z)
+        self.theta += self._w * dt * time_scale
+        self.body.position = (self.r * cos(self.theta), 0.0, self.r * sin(self.theta))
 
-        self.body.rotation_y += self.spin_speed * time.dt * time_scale
+        self.body.rotation_y += self.spin_speed * dt * time_scale
 
 
 class Comet:
+    __slots__ = (
+        "name", "a", "e", "period", "size", "spin_speed", "theta", "_w", "pivot", "body", "orbit",
+        "tail_enabled", "tail_max", "_tail_xyz", "_tail_rgba", "_tail_head", "_tail_len",
+        "_last_tail_pos", "tail_min_step", "tail_entity",
+    )
+
     def __init__(
         self,
         name: str,
@@ -118,6 +130,7 @@ class Comet:
         self.size = size
         self.spin_speed = spin_speed
         self.theta = 0.0
+        self._w = (2 * pi) / self.period  # угловая скорость, рад/с
 
         # Наклон плоскости орбиты кометы
         self.pivot = Entity(rotation=(tilt_deg, 0, 0))
@@ -131,27 +144,31 @@ class Comet:
             texture=tex,
         )
 
-        # Подпись рядом с кометой
-        self.label = Text(
-            text=name,
-            parent=self.body,
-            position=(0.9, 0.9),
-            scale=1.1,
-            color=color.white,
-            billboard=True,
-        )
-
         # Орбита кометы линией (по формуле r(theta))
         self.orbit = self._build_orbit_line()
         self.orbit.parent = self.pivot
         self.orbit.enabled = show_orbit
 
-        # Хвост в виде точек, чтобы не было "вытянутой планеты"
+        # Хвост в виде точек, чтобы не было "вытянутой планеты".
+        # Все точки живут в одном меше: кольцевой буфер позиций и цветов
         self.tail_enabled = tail_enabled
-        self.tail: list[Entity] = []
         self.tail_max = 60
-        self._last_tail_pos: Vec3 | None = None
+        self._tail_xyz = np.zeros((self.tail_max, 3), dtype=np.float32)
+        self._tail_rgba = np.zeros((self.tail_max, 4), dtype=np.float32)
+        self._tail_rgba[:, :3] = (200 / 255, 220 / 255, 1.0)
+        self._tail_head = 0  # куда пишем следующую точку
+        self._tail_len = 0  # сколько точек сейчас видно
+        self._last_tail_pos: tuple[float, float, float] | None = None
         self.tail_min_step = 0.35  # добавляем точку, только если комета заметно сместилась
+        self.tail_entity = Entity(
+            model=Mesh(
+                vertices=self._tail_xyz.ravel(),
+                colors=self._tail_rgba.ravel(),
+                mode="point",
+                thickness=0.08,
+                static=False,
+            ),
+        )
 
     def _r(self, theta: float) -> float:
         # Полярное уравнение эллипса с фокусом в Солнце:
@@ -159,51 +176,60 @@ class Comet:
         return (self.a * (1 - self.e * self.e)) / (1 + self.e * cos(theta))
 
     def _build_orbit_line(self) -> Entity:
-        # Строим линию орбиты кометы по множеству точек
-        seg = 260
-        verts = []
-        for i in range(seg + 1):
-            t = (i / seg) * 2 * pi
-            r = self._r(t)
-            verts.append(Vec3(cos(t) * r, 0, sin(t) * r))
+        # Строим линию орбиты кометы по эксцентрической аномалии E:
+        # x = a(cos E - e), z = b sin E, фокус (Солнце) в начале координат.
+        # При равном шаге по theta точки сгущаются у перигелия и редеют у афелия,
+        # а шаг по E дает почти равномерную длину дуги, поэтому точек нужно вдвое меньше
+        seg = 128
+        E = np.linspace(0, 2 * pi, seg + 1)
+        xs = self.a * (np.cos(E) - self.e)
+        zs = self.a * np.sqrt(1 - self.e * self.e) * np.sin(E)
+        verts = list(zip(xs.tolist(), [0.0] * (seg + 1), zs.tolist()))
         mesh = Mesh(vertices=verts, mode="line", thickness=1)
         return Entity(model=mesh, color=color.rgba(200, 220, 255, 90))
 
-    def _tail_push(self, world_pos: Vec3, strength: float):
+    def _tail_push(self, world_pos: tuple[float, float, float], strength: float):
         # Добавляем точку хвоста, но не чаще чем на заданный шаг
         if self._last_tail_pos is not None:
-            if (world_pos - self._last_tail_pos).length() < self.tail_min_step:
+            lx, ly, lz = self._last_tail_pos
+            wx, wy, wz = world_pos
+            dx, dy, dz = wx - lx, wy - ly, wz - lz
+            if dx * dx + dy * dy + dz * dz < self.tail_min_step * self.tail_min_step:
                 return
         self._last_tail_pos = world_pos
 
-        dot = Entity(
-            model="sphere",
-            scale=0.04 + 0.07 * strength,
-            position=world_pos,
-            color=color.rgba(200, 220, 255, int(20 + 120 * strength)),
-        )
-        self.tail.insert(0, dot)
-
-        if len(self.tail) > self.tail_max:
-            self.tail[-1].disable()
-            self.tail.pop()
+        # Самая старая точка перезаписывается, когда буфер заполнен
+        i = self._tail_head
+        self._tail_xyz[i] = world_pos
+        self._tail_rgba[i, 3] = (20 + 120 * strength) / 255
+        self._tail_head = (i + 1) % self.tail_max
+        self._tail_len = min(self._tail_len + 1, self.tail_max)
+        self.tail_entity.model.generate()
 
     def _tail_decay(self, n: int):
         # Быстро "съедаем" хвост, когда комета далеко от Солнца
+        n = min(n, self._tail_len)
+        if n == 0:
+            return
         for _ in range(n):
-            if self.tail:
-                self.tail[-1].disable()
-                self.tail.pop()
-
-    def update(self, time_scale: float):
+            oldest = (self._tail_head - self._tail_len) % self.tail_max
+            self._tail_rgba[oldest, 3] = 0.0
+            self._tail_len -= 1
+        self.tail_entity.model.generate()
+
+    def clear_tail(self):
+        # Полностью прячем хвост
+        self._tail_rgba[:, 3] = 0.0
+        self._tail_len = 0
+        self._last_tail_pos = None
+        self.tail_entity.model.generate()
+
+    def update(self, dt: float, time_scale: float):
         # Двигаем комету по эллипсу и обновляем хвост
-        w = (2 * pi) / self.period
-        self.theta += w * time.dt * time_scale
-
+        self.theta += self._w * dt * time_scale
         r = self._r(self.theta)
-        local_pos = Vec3(cos(self.theta) * r, 0, sin(self.theta) * r)
-        self.body.position = local_pos
-        self.body.rotation_y += self.spin_speed * time.dt * time_scale
+        self.body.position = (r * cos(self.theta), 0.0, r * sin(self.theta))
+        self.body.rotation_y += self.spin_speed * dt * time_scale
 
         if not self.tail_enabled:
             return
@@ -214,12 +240,116 @@ class Comet:
         strength = 1 - clamp((r - start) / (end - start), 0.0, 1.0)
 
         if strength > 0:
-            world_pos = self.pivot.world_position + local_pos
-            self._tail_push(world_pos, strength)
+            # Мировая позиция тела уже учитывает наклон пивота
+            self._tail_push(tuple(self.body.world_position), strength)
         else:
             self._tail_decay(3)
 
 
+LABEL_SCALE = 1.1  # как у прежних подписей Text(scale=1.1)
+LABEL_OFFSET = (0.9, 0.9)  # сдвиг подписи от центра тела, в размерах тела
+LABEL_FONT_PX = 64  # высота строки в атласе
+
+_label_vertex_shader = """#version 140
+
+uniform mat4 p3d_ModelViewMatrix;
+uniform mat4 p3d_ProjectionMatrix;
+uniform vec3 label_centers[{count}];
+in vec4 p3d_Vertex;
+in vec3 p3d_Normal;
+in vec2 p3d_MultiTexCoord0;
+out vec2 uvs;
+
+void main() {{
+    // В normal лежит сдвиг угла в пространстве камеры (xy) и номер подписи (z)
+    vec4 center = p3d_ModelViewMatrix * vec4(label_centers[int(p3d_Normal.z)], 1.0);
+    center.xy += p3d_Normal.xy;
+    gl_Position = p3d_ProjectionMatrix * center;
+    uvs = p3d_MultiTexCoord0;
+}}
+"""
+
+_label_fragment_shader = """#version 140
+
+uniform sampler2D p3d_Texture0;
+uniform vec4 p3d_ColorScale;
+in vec2 uvs;
+out vec4 fragColor;
+
+void main() {
+    fragColor = texture(p3d_Texture0, uvs) * p3d_ColorScale;
+}
+"""
+
+
+class LabelLayer:
+    # Все подписи одним мешем: текст один раз рисуется в атлас, на каждую
+    # подпись приходится один квад, а к камере их поворачивает вершинный шейдер.
+    # Каждый кадр обновляются только центры подписей (uniform-массив)
+    def __init__(self, objects: list, label_color=color.white):
+        self.bodies = [o.body for o in objects]
+
+        font = ImageFont.truetype(str(application.internal_fonts_folder / Text.default_font), LABEL_FONT_PX)
+        boxes = [font.getbbox(o.name) for o in objects]
+        # Высота строки по реальным границам глифов, чтобы выносные элементы
+        # (р, у) не обрезались и не попадали в соседнюю строку
+        pad = 4
+        glyph_top = min(b[1] for b in boxes)
+        row_h = max(b[3] for b in boxes) - glyph_top + 2 * pad
+        atlas_w = max(b[2] - b[0] for b in boxes) + 8
+        atlas_h = row_h * len(objects)
+
+        atlas = Image.new("RGBA", (atlas_w, atlas_h), (255, 255, 255, 0))
+        draw = ImageDraw.Draw(atlas)
+
+        verts, uvs, normals, tris = [], [], [], []
+        for i, (o, box) in enumerate(zip(objects, boxes)):
+            text_w = box[2] - box[0] + 4
+            draw.text((2 - box[0], i * row_h + pad - glyph_top), o.name, font=font, fill=(255, 255, 255, 255))
+
+            # Размер подписи в мире такой же, как у прежнего Text на теле
+            size = o.body.world_scale_x
+            h = Text.size * LABEL_SCALE * size * row_h / LABEL_FONT_PX
+            w = h * text_w / row_h
+            left = LABEL_OFFSET[0] * size
+            top = LABEL_OFFSET[1] * size
+
+            v0 = 1 - (i + 1) * row_h / atlas_h
+            v1 = 1 - i * row_h / atlas_h
+            u1 = text_w / atlas_w
+            corners = (
+                (left, top - h, 0, v0),
+                (left + w, top - h, u1, v0),
+                (left + w, top, u1, v1),
+                (left, top, 0, v1),
+            )
+            base = len(verts)
+            for dx, dy, u, v in corners:
+                verts.append((0, 0, 0))
+                normals.append((dx, dy, i))
+                uvs.append((u, v))
+            tris.append((base, base + 1, base + 2, base + 3))
+
+        shader = Shader(
+            name="label_shader",
+            language=Shader.GLSL,
+            vertex=_label_vertex_shader.format(count=len(objects)),
+            fragment=_label_fragment_shader,
+        )
+        self.entity = Entity(model=Mesh(vertices=verts, triangles=tris, uvs=uvs, normals=normals))
+        self.entity.texture = Texture(atlas, filtering="mipmap")
+        self.entity.color = label_color
+        self.entity.shader = shader
+        # Вершины сдвигает шейдер, поэтому границы меша не совпадают с картинкой:
+        # отключаем отсечение для этого узла
+        self.entity.node().setBounds(OmniBoundingVolume())
+        self.entity.node().setFinal(True)
+        self.update()
+
+    def update(self):
+        self.entity.set_shader_input("label_centers", [b.world_position for b in self.bodies])
+
+
 app = Ursina()
 application.title = "3D симулятор Солнечной системы (Ursina)"
 
@@ -306,6 +436,9 @@ comet = Comet(
     tail_enabled=True,
 )
 
+# Подписи всех тел
+labels = LabelLayer([*planets, moon, comet])
+
 
 def set_orbits(enabled: bool):
     # Включаем или выключаем все орбиты
@@ -315,6 +448,23 @@ def set_orbits(enabled: bool):
     comet.orbit.enabled = enabled
 
 
+_last_status: str | None = None
+
+
+def update_status():
+    # Перестраиваем текст статуса, только если строка изменилась:
+    # присваивание status.text заново собирает меш текста
+    global _last_status
+    text = (
+        f"Скорость: x{time_scale} | Пауза: {'Да' if paused else 'Нет'} | "
+        f"Орбиты: {'Вкл' if orbits_on else 'Выкл'} | "
+        f"Хвост: {'Вкл' if comet.tail_enabled else 'Выкл'}"
+    )
+    if text != _last_status:
+        status.text = text
+        _last_status = text
+
+
 def input(key):
     global time_scale, paused, orbits_on
 
@@ -347,26 +497,22 @@ def input(key):
     if key == "t":
         comet.tail_enabled = not comet.tail_enabled
         if not comet.tail_enabled:
-            for d in comet.tail:
-                d.disable()
-            comet.tail.clear()
-            comet._last_tail_pos = None
+            comet.clear_tail()
+
+    # Статус зависит только от клавиш, поэтому обновляем его здесь, а не каждый кадр
+    update_status()
 
 
 def update():
     # Обновляем движение объектов, если не пауза
     if not paused:
+        dt = time.dt
         for p in planets:
-            p.update(time_scale)
-        moon.update(time_scale)
-        comet.update(time_scale)
-
-    # Обновляем строку статуса
-    status.text = (
-        f"Скорость: x{time_scale} | Пауза: {'Да' if paused else 'Нет'} | "
-        f"Орбиты: {'Вкл' if orbits_on else 'Выкл'} | "
-        f"Хвост: {'Вкл' if comet.tail_enabled else 'Выкл'}"
-    )
+            p.update(dt, time_scale)
+        moon.update(dt, time_scale)
+        comet.update(dt, time_scale)
+        labels.update()
 
 
+update_status()
 app.run()